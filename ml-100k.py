@@ -1,53 +1,250 @@
-from pymongo import MongoClient
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import MongoClient, ReplaceOne
+import numpy as np
 import pandas as pd
-from bokeh.plotting import figure, show, output_file, output_notebook
+from bokeh.plotting import figure
 from bokeh.layouts import gridplot
 from bokeh.models import ColumnDataSource
+from bokeh.embed import file_html
+from bokeh.resources import CDN
 
-output_notebook()
+# Rows per insert_many batch when streaming CSVs into MongoDB
+CHUNK_SIZE = 5000
 
-def populate_data_if_needed(users_col, movies_col, ratings_col):
+# _id of the doc in each stats collection that records which source snapshot the stats were built from
+STATS_META_ID = "meta"
+
+# Cursor batch size for reading the (small) stats collections back in a single round trip
+STATS_BATCH_SIZE = 10000
+
+def read_table(path: str, **read_csv_kwargs) -> pd.DataFrame:
     """
-    Load raw MovieLens data into MongoDB if collections are empty.
+    Read a whole delimited file with the faster pyarrow engine, falling back to the C engine
+    when pyarrow is not installed. Options pyarrow does not support still raise, so they get fixed.
     """
-    # If any of the three collections already has documents, skip loading entirely.
-    if (users_col.estimated_document_count() > 0 and movies_col.estimated_document_count() > 0 and ratings_col.estimated_document_count() > 0):
-        print("Data already exists in MongoDB collections. Skipping data load.")
-        return
-
-    # 1) Load users
-    users_df = pd.read_csv("ml-100k/u.user", sep="|", names=["user_id", "age", "gender", "occupation", "zip_code"],)
     try:
-        users_col.insert_many(users_df.to_dict("records"))
-    except Exception as e:
-        print(f"Warning: could not insert into users collection: {e}")
+        return pd.read_csv(path, engine="pyarrow", **read_csv_kwargs)
+    except ImportError:
+        return pd.read_csv(path, engine="c", low_memory=False, **read_csv_kwargs)
 
-    # 2) Load movies (first 5 columns + 19 binary genre flags)
-    movies_cols = ["movie_id", "title", "release_date", "video_release_date", "IMDb_URL"] + [f"genre_{i}" for i in range(19)]
-    movies_df = pd.read_csv("ml-100k/u.item", sep="|", encoding="latin-1", usecols=range(24), names=movies_cols)
-    try:
-        movies_col.insert_many(movies_df.to_dict("records"))
-    except Exception as e:
-        print(f"Warning: could not insert into movies collection: {e}")
+def insert_in_chunks(col, df: pd.DataFrame, chunk_size: int = CHUNK_SIZE):
+    """
+    Insert a DataFrame into col in slices, so only one chunk of dicts is ever held in memory.
+    """
+    for start in range(0, len(df), chunk_size):
+        records = df.iloc[start:start + chunk_size].to_dict("records")
+        col.insert_many(records, ordered=False, bypass_document_validation=True)
 
-    # 3) Load ratings
-    ratings_df = pd.read_csv("ml-100k/u.data", sep="\t", names=["user_id", "movie_id", "rating", "timestamp"],)
+def drop_secondary_indexes(col) -> dict:
+    """
+    Drop every index except _id so bulk inserts do not pay for index maintenance.
+    Returns the dropped index specs so they can be rebuilt with restore_indexes.
+    """
+    indexes = {name: info for name, info in col.index_information().items() if name != "_id_"}
+    for name in indexes:
+        col.drop_index(name)
+    return indexes
+
+def restore_indexes(col, indexes: dict):
+    """
+    Rebuild indexes previously removed by drop_secondary_indexes, once the bulk load is done.
+    All options reported by index_information (unique, sparse, partialFilterExpression,
+    expireAfterSeconds, collation, ...) are passed back, except the server-managed v and ns.
+    A failed rebuild (e.g. a unique index over duplicate documents) is reported instead of aborting the run.
+    """
+    for name, info in indexes.items():
+        options = {option: value for option, value in info.items() if option not in ("v", "ns", "key")}
+        try:
+            col.create_index(info["key"], name=name, **options)
+        except Exception as e:
+            print(f"Warning: could not rebuild index {name} on {col.name}: {e}")
+
+def mongoimport_tsv(col, path: str, fields: list, mongo_uri: str) -> bool:
+    """
+    Bulk-load a tab-separated file into the empty collection col with the mongoimport tool,
+    skipping Python dict building entirely. mongo_uri is the same connection string the MongoClient uses;
+    it is passed through a private temporary config file so credentials never show up in the process list.
+    Returns False if mongoimport is not installed or the import fails, so the caller can fall back to pandas.
+    """
+    if shutil.which("mongoimport") is None:
+        return False
+    # The failure cleanup below deletes everything in col, so only import into an empty collection
+    if col.estimated_document_count() > 0:
+        raise ValueError(f"mongoimport_tsv only loads into an empty collection, but {col.name} has data")
+
+    # The config file is created with owner-only permissions; a JSON string is also a valid YAML scalar
+    with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as config:
+        config.write(f"uri: {json.dumps(mongo_uri)}\n")
+    cmd = [
+        "mongoimport",
+        "--config", config.name,
+        "--db", col.database.name,
+        "--collection", col.name,
+        "--type", "tsv",
+        "--columnsHaveTypes",
+        "--fields", ",".join(f"{name}.int32()" for name in fields),
+        "--file", path,
+    ]
     try:
-        ratings_col.insert_many(ratings_df.to_dict("records"))
-    except Exception as e:
-        print(f"Warning: could not insert into ratings collection: {e}")
+        subprocess.run(cmd, check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        print(f"Warning: mongoimport into {col.name} failed: {e.stderr.decode(errors='replace').strip()}")
+        # Drop anything that made it in before the failure so the fallback does not duplicate it
+        col.delete_many({})
+        return False
+    finally:
+        os.remove(config.name)
+    return True
+
+def create_indexes(users_col, movies_col, userinfo_genres_col):
+    """
+    Index the $lookup join keys and the fields the stats pipelines group on.
+    create_index is a no-op when the index already exists.
+    The unique indexes cannot be built over collections that already hold duplicates
+    (e.g. from a partial load made before these indexes existed); such a collection must be
+    dropped by hand and reloaded, so the failure is reported instead of aborting the run.
+    """
+    indexes = [
+        (users_col, "user_id", {"unique": True}),
+        (movies_col, "movie_id", {"unique": True}),
+        *[(userinfo_genres_col, field, {}) for field in ("age", "gender", "occupation")],
+        # $merge into ratings_userinfo_genres matches on (user_id, movie_id), which requires a unique index
+        (userinfo_genres_col, [("user_id", 1), ("movie_id", 1)], {"unique": True}),
+    ]
+    for col, keys, options in indexes:
+        try:
+            col.create_index(keys, **options)
+        except Exception as e:
+            print(f"Warning: could not create index {keys} on {col.name} (drop the collection and reload if it holds duplicates): {e}")
+
+def upgrade_genre_schema(movies_col, userinfo_genres_col, genre_count: int = 19):
+    """
+    Databases filled by earlier versions of this script store 19 genre_i flag fields instead of the
+    sparse genres list. Rebuild genres from those flags in place (MongoDB 4.2+ pipeline update)
+    so the join and stats steps can use the existing data.
+    """
+    for col in (movies_col, userinfo_genres_col):
+        if col.find_one({"genres": {"$exists": False}}, {"_id": 1}) is None:
+            continue
+        print(f"{col.name} uses the old genre_i schema. Rebuilding the genres list.")
+        try:
+            col.update_many(
+                {"genres": {"$exists": False}},
+                [
+                    {"$set": {"genres": {"$concatArrays": [{"$cond": [{"$eq": [f"$genre_{i}", 1]}, [i], []]} for i in range(genre_count)]}}},
+                    {"$unset": [f"genre_{i}" for i in range(genre_count)]},
+                ],
+            )
+        except Exception as e:
+            print(f"Error upgrading {col.name} to the genres list ({e}). Drop the movielens_100k database and rerun to reload it.")
+
+def load_ratings(ratings_col, userinfo_genres_col, users_df: pd.DataFrame, movies_df: pd.DataFrame, load_raw: bool, build_join: bool, mongo_uri: str):
+    """
+    If load_raw is set, load u.data into ratings_col. If build_join is set, join each chunk with
+    users_df and movies_df in pandas and insert the result into userinfo_genres_col.
+    An insert failure is reported for the collection it happened in, and only that side stops loading.
+    """
+    # u.data is tab-separated, so mongoimport can take it directly; we still stream it through
+    # pandas in chunks to build the joined collection (the pyarrow engine cannot read in chunks,
+    # so this one stays on the C engine).
+    ratings_fields = ["user_id", "movie_id", "rating", "timestamp"]
+    user_info = users_df[["user_id", "age", "gender", "occupation"]]
+    movie_genres = movies_df[["movie_id", "genres"]]
+    joined_fields = ["user_id", "movie_id", "rating", "age", "gender", "occupation", "genres"]
+
+    if load_raw and mongoimport_tsv(ratings_col, "ml-100k/u.data", ratings_fields, mongo_uri):
+        load_raw = False
+    if not (load_raw or build_join):
+        return
+
+    for chunk in pd.read_csv("ml-100k/u.data", sep="\t", names=ratings_fields, dtype={"user_id": "int32", "movie_id": "int32", "rating": "int8", "timestamp": "int32"}, chunksize=CHUNK_SIZE):
+        if load_raw:
+            try:
+                insert_in_chunks(ratings_col, chunk)
+            except Exception as e:
+                print(f"Warning: could not insert into {ratings_col.name} collection: {e}")
+                load_raw = False
+        if build_join:
+            try:
+                # Hash join in pandas instead of a nested-loop $lookup on the server
+                joined = chunk.merge(user_info, on="user_id").merge(movie_genres, on="movie_id")
+                insert_in_chunks(userinfo_genres_col, joined[joined_fields])
+            except Exception as e:
+                print(f"Warning: could not insert into {userinfo_genres_col.name} collection: {e}")
+                build_join = False
+        if not (load_raw or build_join):
+            break
+
+def populate_data_if_needed(users_col, movies_col, ratings_col, userinfo_genres_col, mongo_uri: str):
+    """
+    Load raw MovieLens data into MongoDB, filling only the collections that are still empty.
+    The ratings are joined with user info and movie genres in pandas on the way in,
+    so ratings_userinfo_genres is filled without a server-side $lookup.
+    """
+    # Check each collection on its own, so a partially failed earlier load does not insert duplicates
+    load_users = users_col.estimated_document_count() == 0
+    load_movies = movies_col.estimated_document_count() == 0
+    load_raw_ratings = ratings_col.estimated_document_count() == 0
+    if not (load_users or load_movies or load_raw_ratings):
+        print("Data already exists in MongoDB collections. Skipping data load.")
+        return
+
+    # Only build the joined collection if it is empty, otherwise we would duplicate rows
+    build_join = userinfo_genres_col.estimated_document_count() == 0
+
+    # Drop secondary indexes for the duration of the load; they are rebuilt in one pass at the end
+    to_load = [col for col, needed in ((users_col, load_users), (movies_col, load_movies), (ratings_col, load_raw_ratings), (userinfo_genres_col, build_join)) if needed]
+    saved_indexes = [(col, drop_secondary_indexes(col)) for col in to_load]
+
+    # 1) Read users
+    users_df = read_table("ml-100k/u.user", sep="|", names=["user_id", "age", "gender", "occupation", "zip_code"], dtype={"user_id": "int32", "age": "int8"})
+
+    # 2) Read movies (first 5 columns + 19 binary genre flags; u.item has exactly these 24 fields)
+    genre_cols = [f"genre_{i}" for i in range(19)]
+    movies_cols = ["movie_id", "title", "release_date", "video_release_date", "IMDb_URL"] + genre_cols
+    movies_df = read_table("ml-100k/u.item", sep="|", encoding="latin-1", names=movies_cols, dtype={"movie_id": "int32", **{col: "int8" for col in genre_cols}})
+    # Store genres as the list of flagged genre indices (about 2 per movie) instead of 19 flag fields
+    movies_df["genres"] = [[i for i in range(19) if row[i]] for row in movies_df[genre_cols].itertuples(index=False)]
+    movies_df = movies_df.drop(columns=genre_cols)
+
+    # 3) Load users, movies and ratings concurrently; the three loads are independent and mostly wait on the socket
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = {}
+        if load_users:
+            futures["users"] = pool.submit(insert_in_chunks, users_col, users_df)
+        if load_movies:
+            futures["movies"] = pool.submit(insert_in_chunks, movies_col, movies_df)
+        if load_raw_ratings or build_join:
+            futures["ratings"] = pool.submit(load_ratings, ratings_col, userinfo_genres_col, users_df, movies_df, load_raw_ratings, build_join, mongo_uri)
+    for name, future in futures.items():
+        try:
+            future.result()
+        except Exception as e:
+            print(f"Warning: could not load {name}: {e}")
+
+    for col, indexes in saved_indexes:
+        restore_indexes(col, indexes)
 
     print("Data population complete.")
 
 def populate_user_movie_info_if_needed(userinfo_genres_col, ratings_col):
     """
     Create a new collection that combines ratings with user info and movie genres.
+    Normally populate_data_if_needed fills it during the initial load; this $lookup
+    pipeline only runs when the raw collections were loaded without it.
     """
     # If already populated, skip
     if userinfo_genres_col.estimated_document_count() > 0:
         print("ratings_userinfo_genres already has data. Skipping join step.")
         return
 
+    # Each $unwind must directly follow its $lookup (no stages in between) so the server
+    # can fuse the pair into one lookup-unwind stage and never materialize the "as" array.
     pipeline = [
         {
             "$lookup": {
@@ -57,7 +254,7 @@ def populate_user_movie_info_if_needed(userinfo_genres_col, ratings_col):
                 "as": "user_info",
             }
         },
-        {"$unwind": "$user_info"},
+        {"$unwind": {"path": "$user_info", "preserveNullAndEmptyArrays": False}},
         {
             "$lookup": {
                 "from": "movies",
@@ -66,7 +263,7 @@ def populate_user_movie_info_if_needed(userinfo_genres_col, ratings_col):
                 "as": "movie_info",
             }
         },
-        {"$unwind": "$movie_info"},
+        {"$unwind": {"path": "$movie_info", "preserveNullAndEmptyArrays": False}},
         {
             "$project": {
                 "_id": 0,
@@ -76,15 +273,23 @@ def populate_user_movie_info_if_needed(userinfo_genres_col, ratings_col):
                 "age": "$user_info.age",
                 "gender": "$user_info.gender",
                 "occupation": "$user_info.occupation",
-                # Copy all 19 genre flags from movie_info
-                **{f"genre_{i}": f"$movie_info.genre_{i}" for i in range(19)},
+                "genres": "$movie_info.genres",
+            }
+        },
+        {
+            # directly writes into ratings_userinfo_genres, updating rows in place on re-runs
+            "$merge": {
+                "into": "ratings_userinfo_genres",
+                "on": ["user_id", "movie_id"],
+                "whenMatched": "replace",
+                "whenNotMatched": "insert",
             }
         },
-        {"$out": "ratings_userinfo_genres"},  # directly writes into new collection
     ]
 
     # Run the aggregation that writes to ratings_userinfo_genres
     try:
+        # The join writes one doc per rating, so it keeps allowDiskUse for larger datasets
         ratings_col.aggregate(pipeline, allowDiskUse=True)
     except Exception as e:
         print(f"Error during aggregation into ratings_userinfo_genres: {e}")
@@ -92,64 +297,155 @@ def populate_user_movie_info_if_needed(userinfo_genres_col, ratings_col):
 
     print("ratings_userinfo_genres has been created and populated.")
 
-def build_and_insert_stats(source_col, target_col, group_field: str, genre_count: int = 19):
+def source_snapshot(source_col) -> dict:
     """
-    Use MongoDB aggregation to compute average rating and count per (group_field, genre_index).
-    Inserts results directly into target_col.
+    Cheap fingerprint of source_col (document count and largest _id), used to tell whether stats are stale.
     """
-    # If target already has data, skip
-    if target_col.estimated_document_count() > 0:
-        print(f"{target_col.name} already has data. Skipping stats aggregation.")
-        return
+    last_doc = source_col.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    return {"source_count": source_col.estimated_document_count(), "source_max_id": last_doc["_id"] if last_doc else None}
 
-    # We unwind each genre flag and filter out only those where genre_flag == 1
-    # Then group by (group_field, genre_index) to compute avg & count.
-    pipeline = [
-        {
-            # Project group_field and an array of {index, flag} for each genre
-            "$project": {
-                group_field: 1,
-                "rating": 1,
-                "genre_flags": [
-                    {"index": i, "flag": f"$genre_{i}"} for i in range(genre_count)
-                ],
-            }
-        },
-        {"$unwind": "$genre_flags"},
-        {"$match": {"genre_flags.flag": 1}},
+def pending_stats_targets(target_cols: dict, snapshot: dict) -> dict:
+    """
+    Return the subset of target_cols (group_field -> collection) whose meta doc does not match snapshot,
+    i.e. the stats that are missing or were computed from a different version of the source collection.
+    """
+    pending = {}
+    for group_field, target_col in target_cols.items():
+        meta = target_col.find_one({"_id": STATS_META_ID})
+        if meta is not None and all(meta.get(key) == value for key, value in snapshot.items()):
+            print(f"{target_col.name} is up to date. Skipping stats aggregation.")
+        else:
+            pending[group_field] = target_col
+    return pending
+
+def merge_stats(target_col, group_field: str, records: list, snapshot: dict):
+    """
+    Upsert stats docs into target_col keyed on _id = {group_field, genre_index}, the same as a
+    $merge with whenMatched "replace": re-runs overwrite existing tuples in place and keep the indexes.
+    Docs that are not part of the new result (tuples that disappeared from the source, or docs left
+    by older versions of this script) are deleted first.
+    The meta doc recording the source snapshot is written last, so a failed run is retried next time.
+    """
+    requests = []
+    for doc in records:
+        doc["_id"] = {group_field: doc[group_field], "genre_index": doc["genre_index"]}
+        requests.append(ReplaceOne({"_id": doc["_id"]}, doc, upsert=True))
+    target_col.delete_many({"_id": {"$nin": [STATS_META_ID] + [doc["_id"] for doc in records]}})
+    if requests:
+        target_col.bulk_write(requests, ordered=False)
+    target_col.replace_one({"_id": STATS_META_ID}, {"_id": STATS_META_ID, **snapshot}, upsert=True)
+
+def stats_sub_pipeline(group_field: str, genre_labels: list) -> list:
+    """
+    Aggregation stages computing average rating and count per (group_field, genre_index),
+    with the genre's label attached so the results are ready to plot.
+    Used as one branch of the $facet in build_and_insert_stats, so it cannot contain a $facet itself.
+    """
+    return [
+        # genres only holds the flagged genre indices, so this yields about 2 docs per rating
+        {"$unwind": "$genres"},
         {
             "$group": {
-                "_id": {group_field: f"${group_field}", "genre_index": "$genre_flags.index"},
+                "_id": {group_field: f"${group_field}", "genre_index": "$genres"},
                 "avg_rating": {"$avg": "$rating"},
                 "count": {"$sum": 1},
             }
         },
         {
-            # reshape the document for insertion
+            # reshape the document for insertion, keeping the (group_field, genre_index) _id for merge_stats
             "$project": {
-                "_id": 0,
                 group_field: "$_id." + group_field,
                 "genre_index": "$_id.genre_index",
+                "genre_label": {"$arrayElemAt": [genre_labels, "$_id.genre_index"]},
                 "avg_rating": {"$round": ["$avg_rating", 3]},
                 "count": 1,
             }
         },
-        {"$out": target_col.name},
     ]
 
+def build_and_insert_stats(source_col, target_cols: dict, genre_labels: list):
+    """
+    Use a single MongoDB aggregation to compute average rating and count per (group_field, genre_index)
+    for every group_field in target_cols (a mapping of group_field -> target collection).
+    Each $facet branch's results are inserted into its target collection.
+    """
+    snapshot = source_snapshot(source_col)
+    pending = pending_stats_targets(target_cols, snapshot)
+    if not pending:
+        return
+
+    # One scan of source_col feeds every group_field branch
+    pipeline = [{"$facet": {group_field: stats_sub_pipeline(group_field, genre_labels) for group_field in pending}}]
+
     try:
-        source_col.aggregate(pipeline, allowDiskUse=True)
-        print(f"Statistics for {group_field} inserted into {target_col.name}.")
+        # The grouped output is a few thousand docs at most, so keep it in memory. allowDiskUse is
+        # passed explicitly because MongoDB 6.0+ otherwise allows spilling by default.
+        result = next(source_col.aggregate(pipeline, allowDiskUse=False))
     except Exception as e:
-        print(f"Error creating stats for {group_field}: {e}")
+        print(f"Error creating stats for {', '.join(pending)}: {e}")
+        return
+
+    for group_field, target_col in pending.items():
+        try:
+            merge_stats(target_col, group_field, result[group_field], snapshot)
+            print(f"Statistics for {group_field} inserted into {target_col.name}.")
+        except Exception as e:
+            print(f"Error creating stats for {group_field}: {e}")
 
-def populate_statistics_if_needed(userinfo_genres_col, age_stats_col, gender_stats_col, occupation_stats_col):
+def explode_genres(df: pd.DataFrame) -> pd.DataFrame:
     """
-    Populate age, gender, and occupation statistics collections by calling build_and_insert_stats.
+    Turn the joined ratings into long format: one row per (rating, genre) pair, taken straight
+    from the sparse genres list. Built once and shared by every build_stats_with_pandas call.
     """
-    build_and_insert_stats(userinfo_genres_col, age_stats_col, group_field="age")
-    build_and_insert_stats(userinfo_genres_col, gender_stats_col, group_field="gender")
-    build_and_insert_stats(userinfo_genres_col, occupation_stats_col, group_field="occupation")
+    long_df = df.explode("genres").dropna(subset=["genres"])
+    return long_df.rename(columns={"genres": "genre_index"}).astype({"genre_index": "int8"})
+
+def build_stats_with_pandas(long_df: pd.DataFrame, group_field: str, genre_labels: list) -> pd.DataFrame:
+    """
+    Compute average rating and count per (group_field, genre_index) with a vectorized pandas groupby
+    over the long-format table from explode_genres.
+    Returns a DataFrame with columns [group_field, genre_index, genre_label, avg_rating, count].
+    """
+    stats = long_df.groupby([group_field, "genre_index"]).agg(avg_rating=("rating", "mean"), count=("rating", "size")).reset_index()
+    stats["avg_rating"] = stats["avg_rating"].round(3)
+    stats.insert(2, "genre_label", np.array(genre_labels)[stats["genre_index"].to_numpy()])
+    return stats
+
+def populate_statistics_if_needed(userinfo_genres_col, age_stats_col, gender_stats_col, occupation_stats_col, genre_labels: list, use_pandas: bool = True):
+    """
+    Populate age, gender, and occupation statistics collections.
+    By default the joined collection is fetched once and aggregated in pandas;
+    with use_pandas=False the work is done server-side by build_and_insert_stats instead.
+    """
+    target_cols = {"age": age_stats_col, "gender": gender_stats_col, "occupation": occupation_stats_col}
+    if not use_pandas:
+        build_and_insert_stats(userinfo_genres_col, target_cols, genre_labels)
+        return
+
+    snapshot = source_snapshot(userinfo_genres_col)
+    pending = pending_stats_targets(target_cols, snapshot)
+    if not pending:
+        return
+
+    projection = {"_id": 0, "rating": 1, "genres": 1, **{field: 1 for field in pending}}
+    df = pd.DataFrame(list(userinfo_genres_col.find({}, projection)))
+    if df.empty:
+        print(f"{userinfo_genres_col.name} is empty. Skipping stats computation.")
+        return
+    if "genres" not in df.columns:
+        print(f"{userinfo_genres_col.name} has no genres field (old genre_i schema). Drop the movielens_100k database and rerun to reload it.")
+        return
+    # Values come back from BSON as int64; rating (1-5) and age both fit in int8
+    df = df.astype({field: "int8" for field in ("rating", "age") if field in df.columns})
+    long_df = explode_genres(df)
+
+    for group_field, target_col in pending.items():
+        try:
+            stats = build_stats_with_pandas(long_df, group_field, genre_labels)
+            merge_stats(target_col, group_field, stats.to_dict("records"), snapshot)
+            print(f"Statistics for {group_field} inserted into {target_col.name}.")
+        except Exception as e:
+            print(f"Error creating stats for {group_field}: {e}")
 
 def age_to_group(age: int) -> str:
     """
@@ -160,33 +456,44 @@ def age_to_group(age: int) -> str:
     lower = (age // 10) * 10
     return f"{lower}-{lower + 9}"
 
-def make_bokeh_charts(doc_df: pd.DataFrame, group_field: str, group_values: list, genre_labels: list, output_html: str):
+def fill_genre_labels(df: pd.DataFrame, genre_labels: list) -> pd.DataFrame:
+    """
+    Stats docs written before genre_label was stored only carry genre_index; derive the label for those rows.
+    """
+    if "genre_label" not in df.columns:
+        df["genre_label"] = None
+    missing = df["genre_label"].isna()
+    if missing.any():
+        df.loc[missing, "genre_label"] = np.array(genre_labels)[df.loc[missing, "genre_index"].astype(int).to_numpy()]
+    return df
+
+def make_bokeh_charts(doc_df: pd.DataFrame, group_field: str, group_values: list, genre_labels: list, output_html: str, title: str):
     """
-    Given a DataFrame with columns [group_field, genre_index, avg_rating, count],
-    produce a grid of Bokeh charts: two vertical bars per group_value.
+    Given a DataFrame with columns [group_field, genre_label, avg_rating, count],
+    produce a grid of Bokeh charts: two vertical bars per group_value, written to output_html.
     """
     plots = []
+    # Split doc_df in a single pass instead of scanning it with a boolean mask per group value
+    grouped = dict(list(doc_df.groupby(group_field, sort=False)))
 
     for val in group_values:
-        subset = doc_df[doc_df[group_field] == val]
-        if subset.empty:
+        subset = grouped.get(val)
+        if subset is None:
             continue
 
-        subset = subset.copy()
-        subset["genre"] = subset["genre_index"].apply(lambda idx: genre_labels[idx])
+        # Both plots read from the same source; only the column used for the bar height differs
+        src = ColumnDataSource(subset)
 
         # Plot 1: average rating per genre
         p1 = figure(x_range=genre_labels, height=300, width=600, title=f"{group_field.capitalize()}: {val} — Avg Rating", toolbar_location=None,tools="",)
-        src1 = ColumnDataSource(subset)
-        p1.vbar(x="genre", top="avg_rating", width=0.8, source=src1)
+        p1.vbar(x="genre_label", top="avg_rating", width=0.8, source=src)
         p1.xaxis.major_label_orientation = 1.2
         p1.yaxis.axis_label = "Avg Rating"
         p1.y_range.start = 0
 
         # Plot 2: count per genre
         p2 = figure(x_range=genre_labels, height=300, width=600, title=f"{group_field.capitalize()}: {val} — Count", toolbar_location=None, tools="",)
-        src2 = ColumnDataSource(subset)
-        p2.vbar(x="genre", top="count", width=0.8, source=src2)
+        p2.vbar(x="genre_label", top="count", width=0.8, source=src)
         p2.xaxis.major_label_orientation = 1.2
         p2.yaxis.axis_label = "Count"
         p2.y_range.start = 0
@@ -194,44 +501,47 @@ def make_bokeh_charts(doc_df: pd.DataFrame, group_field: str, group_values: list
         plots.append([p1, p2])
 
     if plots:
-        output_file(output_html)
-        show(gridplot(plots))
+        # Render straight to a standalone HTML file that loads BokehJS from the CDN; no browser is opened
+        with open(output_html, "w", encoding="utf-8") as f:
+            f.write(file_html(gridplot(plots), CDN, title))
 
 def plot_statistics(age_stats_col, gender_stats_col, occupation_stats_col, genre_labels):
     """
     Fetch each statistics collection into a DataFrame, then call make_bokeh_charts.
     """
     # 1) Plot Age Groups
-    age_docs = list(age_stats_col.find({}, {"_id": 0}))
+    age_docs = list(age_stats_col.find({"_id": {"$ne": STATS_META_ID}}, {"_id": 0}, batch_size=STATS_BATCH_SIZE))
     if age_docs:
-        df_age = pd.DataFrame(age_docs)
+        df_age = fill_genre_labels(pd.DataFrame(age_docs), genre_labels)
         df_age["age_group"] = df_age["age"].apply(age_to_group)
         all_age_groups = sorted(df_age["age_group"].unique())
         # Remap DataFrame so that grouping is by "age_group"
-        df_age = df_age[["age_group", "genre_index", "avg_rating", "count"]].rename(columns={"age_group": "group"})
-        make_bokeh_charts(df_age, group_field="group", group_values=all_age_groups, genre_labels=genre_labels, output_html="age_group_charts.html")
+        df_age = df_age[["age_group", "genre_label", "avg_rating", "count"]].rename(columns={"age_group": "group"})
+        make_bokeh_charts(df_age, group_field="group", group_values=all_age_groups, genre_labels=genre_labels, output_html="age_group_charts.html", title="Genre Ratings by Age Group")
 
     # 2) Plot Gender
-    gender_docs = list(gender_stats_col.find({}, {"_id": 0}))
+    gender_docs = list(gender_stats_col.find({"_id": {"$ne": STATS_META_ID}}, {"_id": 0}, batch_size=STATS_BATCH_SIZE))
     if gender_docs:
-        df_gender = pd.DataFrame(gender_docs)
+        df_gender = fill_genre_labels(pd.DataFrame(gender_docs), genre_labels)
         df_gender["gender"] = df_gender["gender"].astype(str)
         all_genders = sorted(df_gender["gender"].unique())
-        df_gender = df_gender[["gender", "genre_index", "avg_rating", "count"]].rename(columns={"gender": "group"})
-        make_bokeh_charts(df_gender, group_field="group", group_values=all_genders, genre_labels=genre_labels, output_html="gender_charts.html")
+        df_gender = df_gender[["gender", "genre_label", "avg_rating", "count"]].rename(columns={"gender": "group"})
+        make_bokeh_charts(df_gender, group_field="group", group_values=all_genders, genre_labels=genre_labels, output_html="gender_charts.html", title="Genre Ratings by Gender")
 
     # 3) Plot Occupation
-    occ_docs = list(occupation_stats_col.find({}, {"_id": 0}))
+    occ_docs = list(occupation_stats_col.find({"_id": {"$ne": STATS_META_ID}}, {"_id": 0}, batch_size=STATS_BATCH_SIZE))
     if occ_docs:
-        df_occ = pd.DataFrame(occ_docs)
+        df_occ = fill_genre_labels(pd.DataFrame(occ_docs), genre_labels)
         all_occs = sorted(df_occ["occupation"].unique())
-        df_occ = df_occ[["occupation", "genre_index", "avg_rating", "count"]].rename(columns={"occupation": "group"})
-        make_bokeh_charts(df_occ, group_field="group", group_values=all_occs, genre_labels=genre_labels, output_html="occupation_charts.html",)
+        df_occ = df_occ[["occupation", "genre_label", "avg_rating", "count"]].rename(columns={"occupation": "group"})
+        make_bokeh_charts(df_occ, group_field="group", group_values=all_occs, genre_labels=genre_labels, output_html="occupation_charts.html", title="Genre Ratings by Occupation")
 
 if __name__ == "__main__":
     # 1) Connect to MongoDB
     # Using 'localhost' works when the code is running on the database host, which is what I am doing. Otherwise, use the IP address.
-    client = MongoClient("mongodb://localhost:27017/")
+    # The URI is also handed to mongoimport (through a private temporary config file, not its command line)
+    mongo_uri = "mongodb://localhost:27017/"
+    client = MongoClient(mongo_uri)
     db = client["movielens_100k"]
 
     # 2) Reference raw collections
@@ -244,18 +554,20 @@ if __name__ == "__main__":
     age_stats_col = db["age_genre_rating_stats"]
     gender_stats_col = db["gender_genre_rating_stats"]
     occupation_stats_col = db["occupation_genre_rating_stats"]
+    create_indexes(users_col, movies_col, userinfo_genres_col)
+    upgrade_genre_schema(movies_col, userinfo_genres_col)
 
     # 4) Define genre labels
     genre_labels = ["unknown", "Action", "Adventure", "Animation", "Children's", "Comedy", "Crime", "Documentary", "Drama", "Fantasy", "Film-Noir", "Horror", "Musical", "Mystery", "Romance", "Sci-Fi", "Thriller", "War", "Western"]
 
     # 5) Data population
-    populate_data_if_needed(users_col, movies_col, ratings_col)
+    populate_data_if_needed(users_col, movies_col, ratings_col, userinfo_genres_col, mongo_uri)
 
-    # 6) Join ratings with user info and movie genres
+    # 6) Join ratings with user info and movie genres (skipped if step 5 already built it)
     populate_user_movie_info_if_needed(userinfo_genres_col, ratings_col)
 
-    # 7) Compute and populate statistics in MongoDB directly
-    populate_statistics_if_needed(userinfo_genres_col, age_stats_col, gender_stats_col, occupation_stats_col)
+    # 7) Compute statistics and store them in MongoDB
+    populate_statistics_if_needed(userinfo_genres_col, age_stats_col, gender_stats_col, occupation_stats_col, genre_labels)
 
     # 8) Render Bokeh charts
     plot_statistics(age_stats_col, gender_stats_col, occupation_stats_col, genre_labels)